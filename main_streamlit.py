@@ -1,36 +1,44 @@
 # main.py
 import os
-import json
-import requests
-from typing import List, Dict, Generator
+import re
+import orjson
+import time
+import asyncio
+import aiohttp
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Generator, Optional, Tuple
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
 import streamlit as st
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin, urlsplit, urlunsplit
 
 # --- Configuration and Initialization ---
 
-def configure_api(api_key: str):
+@st.cache_resource(max_entries=64, show_spinner=False)
+def get_model(api_key: str, json_output: bool = False) -> genai.GenerativeModel:
     """
-    Configures the Generative AI API using the key provided by the user.
+    Returns a Gemini model bound to the given API key, built once per key and reused
+    across reruns so the SDK can keep its client connection warm.
+    json_output selects the JSON-mode model.
     """
-    if not api_key:
-        st.error("API Key is missing. Please provide a valid Gemini API key.")
-        st.stop()
-        
-    try:
-        genai.configure(api_key=api_key)
-        st.success("Gemini API configured successfully.")
-        return True
-    except Exception as e:
-        st.error(f"Failed to configure API: {e}")
-        st.stop()
-        return False
+    generation_config = {"response_mime_type": "application/json"} if json_output else None
+    model = genai.GenerativeModel(model_name='gemini-1.5-flash', generation_config=generation_config)
+    # Attach a client built from this key. Otherwise the model picks up the SDK's process-wide
+    # default client on first use, which is shared by every session.
+    # _client is private: the SDK version pinned in requirements.txt creates it as None and
+    # fills it lazily in generate_content, so fail loudly if an upgrade renames it.
+    assert hasattr(model, "_client"), "google-generativeai no longer exposes GenerativeModel._client"
+    model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+    return model
 
 
 # --- Web Scraping Class ---
 
+BLANK_LINES_RE = re.compile(r"\n{2,}")
+
 class Website:
     """
     A class to represent and scrape a single webpage.
@@ -39,46 +47,203 @@ class Website:
     HEADERS = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36"
     }
+    MAX_PAGE_BYTES = 2_000_000  # anything past this is almost always bundled JS or embedded data
+    IRRELEVANT_TAGS = ["script", "style", "img", "input", "nav", "footer", "header"]
+    # One query for both jobs: links outside the dropped sections, plus the sections themselves
+    PARSE_SELECTOR = (
+        "a[href]:not(" + ", ".join(f"{tag} a" for tag in IRRELEVANT_TAGS) + "), " + ", ".join(IRRELEVANT_TAGS)
+    )
+    MAX_LINK_LENGTH = 2048  # common practical URL limit; longer hrefs are junk or hostile
+    # In-page anchors, non-page schemes and asset files, checked with one C-level search per href.
+    # Keep this pattern to plain alternations: no nested quantifiers, so matching stays linear.
+    SKIP_LINK_RE = re.compile(
+        r"^(?:#|mailto:|tel:|javascript:)|\.(?:png|jpe?g|gif|svg|css|js|pdf|ico|woff2?|ttf)(?:[?#]|$)",
+        re.IGNORECASE,
+    )
 
-    def __init__(self, url: str):
+    def __init__(self, url: str, title: str = "No title found", text: str = "", links: List[str] = None):
         self.url = url
-        self.title = "No title found"
-        self.text = ""
-        self.links = []
-        
-        try:
-            response = requests.get(url, headers=self.HEADERS, timeout=10)
-            response.raise_for_status()
-
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            self.title = soup.title.string if soup.title else "No title found"
-            
-            if soup.body:
-                for irrelevant in soup.body(["script", "style", "img", "input", "nav", "footer", "header"]):
-                    irrelevant.decompose()
-                self.text = soup.body.get_text(separator="\n", strip=True)
+        self.title = title
+        self.text = text
+        self.links = links or []
+
+    @classmethod
+    def parse(cls, url: str, html: bytes) -> "Website":
+        """
+        Builds a Website from already-downloaded HTML. Pure parsing, no network access.
+        """
+        tree = LexborHTMLParser(html)
+
+        title_node = tree.css_first("title")
+        title = title_node.text(strip=True) if title_node else "No title found"
+
+        page_links = []
+        irrelevant = []
+        for node in tree.css(cls.PARSE_SELECTOR):
+            if node.tag == "a":
+                page_links.append(node.attributes["href"])
             else:
-                self.text = ""
-                
-            page_links = [link.get('href') for link in soup.find_all('a')]
-            # Convert relative links to absolute and filter
-            self.links = [urljoin(self.url, link) for link in page_links if link and not link.startswith(('#', 'mailto:', 'tel:'))]
+                irrelevant.append(node)
+        # Matches come in document order, so reversing it removes descendants before their ancestors
+        for node in reversed(irrelevant):
+            node.decompose()
+
+        if tree.body:
+            # Whitespace-only text nodes come back as empty lines; collapse them
+            text = BLANK_LINES_RE.sub("\n", tree.body.text(separator="\n", strip=True)).strip()
+        else:
+            text = ""
+
+        links = cls.clean_links(url, page_links)
+
+        return cls(url, title, text, links)
+
+    @staticmethod
+    def is_same_site(host: str, site: str) -> bool:
+        """
+        Checks whether a host is the site's host or one of its subdomains. The site is
+        the base host without a leading "www.", so www.example.com and careers.example.com
+        match example.com, while other.co.uk never matches shop.co.uk.
+        """
+        return host == site or host.endswith("." + site)
+
+    @classmethod
+    def clean_links(cls, url: str, hrefs: List[str]) -> List[str]:
+        """
+        Converts hrefs to absolute page URLs on the same site, stripping query strings
+        and fragments, dropping asset files and removing duplicates (order is kept).
+        """
+        base = urlsplit(url)
+        base_prefix = f"{base.scheme}://{base.netloc}"
+        site = base.hostname or ""
+        if site.startswith("www."):
+            site = site[4:]
+        # The page itself and the site root, with or without "www." and on either scheme,
+        # are the landing page rather than a sub-page
+        seen = {base_prefix + (base.path or "/")}
+        seen.update(f"{scheme}://{host}/" for scheme in ("http", "https") for host in (site, "www." + site))
+        links = []
+
+        for href in hrefs:
+            if not href or len(href) > cls.MAX_LINK_LENGTH or cls.SKIP_LINK_RE.search(href):
+                continue
+            if href.startswith("/") and not href.startswith("//") and "/." not in href:
+                # Root-relative path, by far the most common case: same site, no URL parsing needed
+                link = base_prefix + href.partition("#")[0].partition("?")[0]
+            else:
+                try:
+                    parts = urlsplit(href if href.startswith(("http://", "https://")) else urljoin(url, href))
+                    host = parts.hostname or ""
+                except ValueError:
+                    continue
+                if parts.scheme not in ("http", "https"):
+                    continue
+                # Off-site links (social media, CDNs, partners) never make useful brochure pages
+                if not cls.is_same_site(host, site):
+                    continue
+                # Empty path means the site root; spell it "/" like the fast path and the seen set do
+                link = urlunsplit((parts.scheme, parts.netloc, parts.path or "/", "", ""))
+            if link not in seen:
+                seen.add(link)
+                links.append(link)
 
-        except requests.exceptions.RequestException as e:
-            st.warning(f"Could not fetch website {self.url}: {e}")
+        return links
 
     def get_contents(self) -> str:
         return f"Webpage Title: {self.title}\nWebpage Contents:\n{self.text}\n\n"
 
+
+SCRAPE_DEADLINE = 25  # seconds for a whole batch of pages, so one slow page can't hold up the brochure
+MAX_REQUESTS_PER_HOST = 4  # keeps a burst of sub-pages under typical rate limits
+
+async def fetch_many(urls: List[str]) -> Tuple[List[Optional[Website]], Dict[str, str]]:
+    """
+    Fetches and parses several pages concurrently over one shared HTTP session.
+    Results come back in input order, with None for pages that fail to download or
+    are still pending when SCRAPE_DEADLINE runs out, so they are never cached.
+    Errors are returned by URL rather than shown, so this is safe to run off the script thread.
+    Parsing runs on a small thread pool so it never stalls the downloads still in flight.
+    """
+    errors = {}
+    if not urls:
+        return [], errors
+
+    loop = asyncio.get_running_loop()
+    connector = aiohttp.TCPConnector(limit=20, keepalive_timeout=10)
+    timeout = aiohttp.ClientTimeout(total=10)
+    semaphore = asyncio.Semaphore(10)
+    # Acquired before the request starts, so time spent queued doesn't count against its timeout
+    host_limits = defaultdict(lambda: asyncio.Semaphore(MAX_REQUESTS_PER_HOST))
+
+    with ThreadPoolExecutor(max_workers=8) as parser_pool:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=Website.HEADERS) as session:
+
+            async def fetch(url: str) -> Optional[Website]:
+                html = bytearray()
+                try:
+                    async with host_limits[urlsplit(url).netloc], semaphore:
+                        async with session.get(url) as response:
+                            response.raise_for_status()
+                            async for chunk in response.content.iter_chunked(65536):
+                                html.extend(chunk)
+                                if len(html) >= Website.MAX_PAGE_BYTES:
+                                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    errors[url] = f"Could not fetch website {url}: {e}"
+                    return None
+                return await loop.run_in_executor(parser_pool, Website.parse, url, bytes(html[:Website.MAX_PAGE_BYTES]))
+
+            tasks = [asyncio.ensure_future(fetch(url)) for url in urls]
+            done, pending = await asyncio.wait(tasks, timeout=SCRAPE_DEADLINE)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for url, task in zip(urls, tasks):
+                if task in pending:
+                    errors[url] = f"Skipped {url}: it did not load within {SCRAPE_DEADLINE} seconds."
+
+            return [task.result() if task in done else None for task in tasks], errors
+
+
+class FetchError(Exception):
+    """Raised when a page could not be downloaded or did not load in time."""
+
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def fetch_page(url: str) -> Tuple[str, str, List[str]]:
+    """
+    Scrapes one page and returns its (title, text, links), cached by URL so that reruns
+    for the same site skip the network. Failures raise FetchError; Streamlit never caches
+    an exception, so a transient error or timeout is retried on the next run.
+    """
+    (site,), errors = asyncio.run(fetch_many([url]))
+    if site is None:
+        raise FetchError(errors[url])
+    return site.title, site.text, site.links
+
 # --- AI-Powered Functions ---
 
-def get_relevant_links(website: Website) -> List[Dict[str, str]]:
+def get_relevant_links(website: Website, api_key: str) -> List[Dict[str, str]]:
     """
     Uses Gemini AI to analyze links and identify relevant ones for a brochure.
     """
     st.info(f"AI is analyzing links from {website.url}...")
-    
+
+    try:
+        links = classify_links(website.url, tuple(website.links), get_model(api_key, json_output=True))
+        st.success("AI analysis complete. Found relevant links.")
+        return links
+    except Exception as e:
+        st.error(f"An error occurred during AI link analysis: {e}")
+        return []
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def classify_links(base_url: str, links: Tuple[str, ...], _model: genai.GenerativeModel) -> List[Dict[str, str]]:
+    """
+    Asks Gemini which of the links are worth including in a brochure. Results are cached
+    per site and link set (the model is left out of the cache key, so any user's key can
+    reuse them); errors propagate to the caller, so failures are never cached.
+    """
     system_prompt = (
         "You are an expert assistant analyzing website links to identify pages for a company brochure. "
         "Focus on 'About Us', 'Company', 'Solutions', 'Products', or 'Careers'. "
@@ -87,53 +252,113 @@ def get_relevant_links(website: Website) -> List[Dict[str, str]]:
     )
 
     user_prompt = (
-        f"Base URL: {website.url}\n"
+        f"Base URL: {base_url}\n"
         f"Here are the links from the website. Return the relevant ones in the specified JSON format.\n\n"
-        f"Links:\n" + "\n".join(website.links)
+        f"Links:\n" + "\n".join(links)
     )
 
-    try:
-        model = genai.GenerativeModel(
-            model_name='gemini-1.5-flash',
-            generation_config={"response_mime_type": "application/json"}
-        )
-        response = model.generate_content([system_prompt, user_prompt])
-        
-        result_json = json.loads(response.text)
-        st.success("AI analysis complete. Found relevant links.")
-        return result_json.get("links", [])
-    except Exception as e:
-        st.error(f"An error occurred during AI link analysis: {e}")
-        return []
+    response = _model.generate_content([system_prompt, user_prompt])
+
+    result_json = orjson.loads(response.text)
+    return result_json.get("links", [])
 
-def get_all_details(url: str) -> str:
+def budget_text(sections: List[Tuple[str, str]], max_chars: int = 60_000) -> str:
+    """
+    Joins labelled page contents into one prompt text of at most ~max_chars characters.
+    Short sections are kept whole and their unused share is redistributed; longer
+    sections are trimmed back to the last sentence or line break within their share.
+    """
+    budgets = [0] * len(sections)
+    remaining = max_chars
+    by_length = sorted(range(len(sections)), key=lambda i: len(sections[i][1]))
+    for position, index in enumerate(by_length):
+        share = remaining // (len(sections) - position)
+        budgets[index] = min(len(sections[index][1]), share)
+        remaining -= budgets[index]
+
+    all_text = ""
+    for (label, content), budget in zip(sections, budgets):
+        if len(content) > budget:
+            content = content[:budget]
+            cut = max(content.rfind(". "), content.rfind("\n"))
+            if cut >= budget // 2:
+                content = content[:cut + 1]
+            content += "\n\n"
+        all_text += f"== START: Content from {label} ==\n{content}== END: Content from {label} ==\n\n"
+    return all_text
+
+# Sub-pages whose path looks brochure-worthy are scraped while Gemini is still classifying links
+LIKELY_RELEVANT_RE = re.compile(r"about|compan|career|job|product|solution|team|mission|customer", re.IGNORECASE)
+MAX_SPECULATIVE_PAGES = 6
+
+def get_all_details(url: str, api_key: str) -> str:
     """
     Gathers all textual content from the main page and other relevant pages.
+    Likely sub-pages are fetched speculatively during the AI link analysis, one future per
+    page, and only the pages the AI picks are waited for. Streamlit output stays on the
+    script thread; the workers only call fetch_page.
     """
     st.info("Step 1: Scraping landing page...")
-    main_site = Website(url)
-    all_text = f"== START: Content from Landing Page ({url}) ==\n{main_site.get_contents()}== END: Content from Landing Page ==\n\n"
+    try:
+        main_site = Website(url, *fetch_page(url))
+    except FetchError as e:
+        st.warning(str(e))
+        main_site = Website(url)
+    sections = [(f"Landing Page ({url})", main_site.get_contents())]
 
     st.info("Step 2: Finding and scraping relevant sub-pages...")
-    relevant_links = get_relevant_links(main_site)
+    candidates = tuple(
+        link for link in main_site.links if LIKELY_RELEVANT_RE.search(urlsplit(link).path)
+    )[:MAX_SPECULATIVE_PAGES]
+
+    # Sub-pages share the site's host, so the worker count doubles as the per-host request cap
+    scrape_pool = ThreadPoolExecutor(max_workers=MAX_REQUESTS_PER_HOST)
+    try:
+        futures = {link: scrape_pool.submit(fetch_page, link) for link in candidates}
 
-    if not relevant_links:
-        st.warning("No relevant sub-pages found by AI. Proceeding with landing page content only.")
-        return all_text
+        relevant_links = [link_info for link_info in get_relevant_links(main_site, api_key) if link_info.get("url")]
+
+        if not relevant_links:
+            st.warning("No relevant sub-pages found by AI. Proceeding with landing page content only.")
+            return budget_text(sections)
+
+        for link_info in relevant_links:
+            st.info(f"Scraping '{link_info.get('type', 'page')}' page: {link_info['url']}")
+        relevant_urls = list(dict.fromkeys(link_info["url"] for link_info in relevant_links))
+        for link, future in futures.items():
+            if link not in relevant_urls:
+                future.cancel()
+        for link_url in relevant_urls:
+            if link_url not in futures:
+                futures[link_url] = scrape_pool.submit(fetch_page, link_url)
+
+        wait([futures[link_url] for link_url in relevant_urls], timeout=SCRAPE_DEADLINE)
+    finally:
+        # Never wait on guesses the AI didn't pick: queued ones are dropped, running ones
+        # finish in the background (only filling fetch_page's cache)
+        scrape_pool.shutdown(wait=False, cancel_futures=True)
 
     for link_info in relevant_links:
-        link_url = link_info.get("url")
+        link_url = link_info["url"]
         link_type = link_info.get("type", "page")
-        if link_url:
-            st.info(f"Scraping '{link_type}' page: {link_url}")
-            page_content = Website(link_url).get_contents()
-            all_text += f"== START: Content from {link_type.title()} Page ({link_url}) ==\n{page_content}== END: Content from {link_type.title()} Page ==\n\n"
+        future = futures[link_url]
+        if not future.done():
+            st.warning(f"Skipped {link_url}: it did not load within {SCRAPE_DEADLINE} seconds.")
+            continue
+        if isinstance(future.exception(), FetchError):
+            st.warning(str(future.exception()))
+            continue
+        sections.append((f"{link_type.title()} Page ({link_url})", Website(link_url, *future.result()).get_contents()))
 
-    return all_text
+    return budget_text(sections)
 
-def stream_brochure(company_name: str, all_text: str, tone: str) -> Generator[str, None, None]:
+STREAM_FLUSH_INTERVAL = 0.066  # seconds; faster UI updates are not perceptible
+
+def stream_brochure(company_name: str, all_text: str, tone: str, api_key: str) -> Generator[str, None, None]:
     """
     Generates and streams a company brochure, yielding chunks of text.
+    Chunks are batched to at most ~15 yields per second (the first one is yielded
+    immediately), since every yield makes st.write_stream re-render the Markdown.
     """
     system_prompt = (
         f"You are an expert marketing assistant. Write a compelling, {tone} company brochure "
@@ -149,31 +374,47 @@ def stream_brochure(company_name: str, all_text: str, tone: str) -> Generator[st
     )
 
     try:
-        model = genai.GenerativeModel(model_name='gemini-1.5-flash')
-        stream = model.generate_content(
+        stream = get_model(api_key).generate_content(
             [system_prompt, user_prompt],
             stream=True
         )
+        buffer = []
+        last_flush = float("-inf")
         for chunk in stream:
-            yield chunk.text
+            buffer.append(chunk.text)
+            now = time.monotonic()
+            if now - last_flush >= STREAM_FLUSH_INTERVAL:
+                yield "".join(buffer)
+                buffer.clear()
+                last_flush = now
+        if buffer:
+            yield "".join(buffer)
     except Exception as e:
         st.error(f"An error occurred during brochure generation: {e}")
         yield ""
 
 # --- Streamlit UI ---
 
+URL_RE = re.compile(r"^https?://[^/\s]+", re.IGNORECASE)
+
 def run_app():
     """
     Defines the Streamlit user interface and runs the main application logic.
     """
     st.set_page_config(page_title="AI Brochure Generator", page_icon="🤖", layout="wide")
+    load_dotenv()
     st.title("🤖 AI-Powered Company Brochure Generator")
     st.markdown("Enter a company's name and website, provide your Gemini API Key, and the AI will generate a brochure.")
     
     with st.sidebar:
         st.header("Configuration")
         
-        api_key = st.text_input("Enter your Gemini API Key", type="password", help="Your API key is not stored.")
+        api_key = st.text_input(
+            "Enter your Gemini API Key",
+            type="password",
+            help="Your API key is not stored. Leave empty to use GEMINI_API_KEY from the environment or .env file.",
+        )
+        api_key = api_key or os.getenv("GEMINI_API_KEY", "")
         
         company_name = st.text_input("Company Name", placeholder="e.g., Hugging Face")
         url = st.text_input("Company Website URL", placeholder="https://huggingface.co")
@@ -194,14 +435,10 @@ def run_app():
             st.warning("Please enter both a company name and a URL.")
             st.stop()
         
-        parsed_url = urlparse(url)
-        if not all([parsed_url.scheme, parsed_url.netloc]):
+        if not URL_RE.match(url):
              st.warning("Please enter a valid, full URL (e.g., https://example.com).")
              st.stop()
 
-        # Configure the API with the user-provided key first
-        configure_api(api_key)
-
         st.subheader(f"Generating Brochure for {company_name}...")
         
         # This container will hold all the status updates and the final output
@@ -209,12 +446,12 @@ def run_app():
         
         with container:
             with st.spinner("Processing... This may take a moment."):
-                all_text = get_all_details(url)
+                all_text = get_all_details(url, api_key)
                 
                 st.subheader("Your Generated Brochure")
                 st.markdown("---")
                 # Use st.write_stream to render the generator's output
-                st.write_stream(stream_brochure(company_name, all_text, tone))
+                st.write_stream(stream_brochure(company_name, all_text, tone, api_key))
                 st.success("Brochure generation complete!")
 
 